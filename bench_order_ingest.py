@@ -0,0 +1,120 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+from conftest import load_orders_csv
+from yearly_profit_class import FifoMatcher, OrderColumns, UpbitAPI, _json_loads, market_units
+
+# Build /v1/orders pages that look like the rows saved in orders.csv.
+# orders.csv is an append-only dump with repeats, so each market's unique
+# orders are copied into later, non-overlapping periods with fresh uuids.
+rows = load_orders_csv()
+
+ORDERS_PER_MARKET = 2500
+
+
+def market_orders(market, n=ORDERS_PER_MARKET):
+    unique = {row["uuid"]: row for row in rows if row["market"] == market}
+    base = sorted(unique.values(), key=lambda x: x["created_at"])
+    orders = []
+    for copy in range(n // len(base) + 1):
+        shift = timedelta(days=1000 * copy)
+        for order in base:
+            created_at = datetime.fromisoformat(order["created_at"]) + shift
+            orders.append(dict(order, uuid=f"{order['uuid']}-{copy}",
+                               created_at=created_at.isoformat()))
+    return orders[:n][::-1]  # newest first, like /v1/orders
+
+
+def to_pages(orders):
+    return [json.dumps(orders[i:i + 100]).encode() for i in range(0, len(orders), 100)]
+
+
+pages_by_market = {market: to_pages(market_orders(market))
+                   for market in sorted({row["market"] for row in rows})}
+pages = [page for market_pages in pages_by_market.values() for page in market_pages]
+PAGES = len(pages)
+
+
+upbit = UpbitAPI("bench", "bench")
+
+
+def ingest_dicts(_):
+    """Current path: json → dicts → float() per field, market by market."""
+    results = {}
+    for market, market_pages in pages_by_market.items():
+        orders = []
+        for raw in market_pages:
+            orders.extend(json.loads(raw))
+        results[market] = dict(upbit.calculate_real_pnl(orders))
+    return results
+
+
+def ingest_columns(_, exact=False):
+    """Fast path: fast decoder → column buffers → bulk float64 (or units), market by market."""
+    results = {}
+    for market, market_pages in pages_by_market.items():
+        columns = OrderColumns(exact=exact)
+        for raw in market_pages:
+            columns.append_page(_json_loads(raw))
+        results[market] = dict(upbit.calculate_columns_pnl(columns, exact=exact))
+    return results
+
+
+def decode_dicts(pages):
+    for raw in pages:
+        for order in json.loads(raw):
+            float(order["price"]), float(order["executed_volume"]), float(order["paid_fee"])
+
+
+def decode_columns(pages):
+    columns = OrderColumns()
+    for raw in pages:
+        columns.append_page(_json_loads(raw))
+
+
+def open_lots(exact):
+    """Open lots left per market after FIFO matching orders.csv."""
+    lots = {}
+    for market in pages_by_market:
+        unique = {row["uuid"]: row for row in rows if row["market"] == market}
+        orders = sorted(unique.values(), key=lambda x: x["created_at"])
+        units = None
+        if exact:
+            units = market_units(*([o[name] for o in orders] for name in OrderColumns.NUMERIC_FIELDS))
+        matcher = FifoMatcher(units)
+        for order in orders:
+            matcher.add_order(order)
+        lots[market] = len(matcher.inventory)
+    return lots
+
+
+def bench(name, func, repeat=5, count=PAGES * 100):
+    best = min(_timed(func) for _ in range(repeat))
+    print(f"{name:<28} {best * 1000:8.1f} ms  ({count / best:,.0f} orders/s)")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func(pages)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"{PAGES} pages x 100 orders, decoder: {_json_loads.__module__}")
+    bench("decode: json + float()", decode_dicts)
+    bench("decode: fast + columns", decode_columns)
+    bench("end-to-end: dicts", ingest_dicts, repeat=1)
+    bench("end-to-end: columns", ingest_columns, repeat=1)
+
+    assert ingest_dicts(pages) == ingest_columns(pages)
+
+    # Float vs exact (scaled-integer units per market)
+    bench("end-to-end: columns (exact)", lambda p: ingest_columns(p, exact=True), repeat=1)
+    history = rows * 50
+    bench("calculate_real_pnl: float", lambda _: upbit.calculate_real_pnl(history), count=len(history))
+    bench("calculate_real_pnl: exact", lambda _: upbit.calculate_real_pnl(history, exact=True),
+          count=len(history))
+
+    for label, exact in (("float", False), ("exact", True)):
+        print(f"open lots after matching ({label}): {open_lots(exact)}")
@@ -0,0 +1,43 @@
+import ast
+import csv
+import os
+
+import pytest
+
+from yearly_profit_class import UpbitAPI
+
+ORDERS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orders.csv")
+
+
+def load_orders_csv(path=ORDERS_CSV):
+    """Rows of orders.csv (one /v1/orders dict per line), repeats included."""
+    with open(path, newline="") as file:
+        return [ast.literal_eval(row[0]) for row in csv.reader(file)]
+
+
+@pytest.fixture(scope="session")
+def order_rows():
+    return load_orders_csv()
+
+
+@pytest.fixture(scope="session")
+def orders_by_market(order_rows):
+    """{ market: orders } from orders.csv, each uuid once, oldest first."""
+    by_market = {}
+    for row in order_rows:
+        by_market.setdefault(row["market"], {})[row["uuid"]] = row
+    return {market: sorted(unique.values(), key=lambda x: x["created_at"])
+            for market, unique in sorted(by_market.items())}
+
+
+@pytest.fixture
+def make_upbit():
+    """UpbitAPI with dummy keys; keyword arguments go to the constructor."""
+    def make(**kwargs):
+        return UpbitAPI("test-access-key", "test-secret-key-of-at-least-32-bytes", **kwargs)
+    return make
+
+
+@pytest.fixture
+def upbit(make_upbit):
+    return make_upbit()
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import yearly_profit_class
+from yearly_profit_class import _backtest_worker
+
+
+def make_candles(n, seed=1):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2022-01-01", periods=n, freq="D").strftime("%Y-%m-%dT%H:%M:%S")
+    close = np.round(5e7 * np.exp(np.cumsum(rng.normal(0, 0.02, n))))
+    return list(dates), close
+
+
+def test_worker_matches_loop_reference(upbit):
+    dates, close = make_candles(500)
+    created_at = [d + "+09:00" for d in dates]
+    (result,) = _backtest_worker(("KRW-BTC", created_at, close, [(7, 30)], 1e6, 0.0005))
+
+    # Same rule written as a plain loop over pandas rolling means
+    series = pd.Series(close)
+    holding = (series.rolling(7).mean() > series.rolling(30).mean()).to_numpy()
+    orders, prev, volume = [], False, None
+    for t in range(len(close)):
+        if holding[t] and not prev:
+            volume, side = np.floor(1e6 / close[t] * 1e8) / 1e8, "bid"
+        elif prev and not holding[t]:
+            side = "ask"
+        else:
+            prev = holding[t]
+            continue
+        prev = holding[t]
+        orders.append({"side": side, "price": str(float(close[t])), "executed_volume": str(float(volume)),
+                       "paid_fee": str(float(close[t] * volume * 0.0005)), "created_at": created_at[t]})
+
+    # The worker passes floats straight to the matcher: no rounding of fees
+    assert result[3] == len(orders)
+    assert result[4] == sum(upbit.calculate_real_pnl(orders).values())
+
+
+def test_load_candles_refreshes_stale_cache(upbit, tmp_path):
+    fetched = []
+
+    def get_candles(market, unit="days", count=200):
+        fetched.append(count)
+        dates, close = make_candles(count, seed=len(fetched))
+        return [{"candle_date_time_kst": d, "trade_price": c} for d, c in zip(dates, close)][::-1]
+
+    upbit.get_candles = get_candles
+    cache_dir = str(tmp_path)
+
+    first = upbit.load_candles("KRW-BTC", count=50, cache_dir=cache_dir)
+    assert upbit.load_candles("KRW-BTC", count=50, cache_dir=cache_dir).equals(first)
+    assert len(fetched) == 1
+
+    upbit.load_candles("KRW-BTC", count=50, cache_dir=cache_dir, refresh=True)
+    assert len(fetched) == 2
+
+    path = os.path.join(cache_dir, "KRW-BTC-days.csv")
+    old = yearly_profit_class.time.time() - 7200
+    os.utime(path, (old, old))
+    upbit.load_candles("KRW-BTC", count=50, cache_dir=cache_dir)
+    assert len(fetched) == 3
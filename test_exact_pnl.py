@@ -0,0 +1,88 @@
+from collections import defaultdict, deque
+from decimal import Decimal
+
+import pytest
+
+from yearly_profit_class import FifoMatcher, OrderColumns, market_units, to_units
+
+
+def decimal_fifo(orders):
+    """Reference FIFO on Decimal. Returns: (pnl_by_date, open lot volumes)"""
+    inventory = deque()
+    pnl_by_date = defaultdict(Decimal)
+    for order in sorted(orders, key=lambda x: x["created_at"]):
+        price, volume = Decimal(order["price"]), Decimal(order["executed_volume"])
+        if order["side"] == "bid":
+            inventory.append([price, volume])
+            continue
+        realized, remaining = Decimal(0), volume
+        while remaining > 0 and inventory:
+            buy_price, buy_volume = inventory.popleft()
+            matched = min(remaining, buy_volume)
+            realized += (price - buy_price) * matched
+            if buy_volume > matched:
+                inventory.appendleft([buy_price, buy_volume - matched])
+            remaining -= matched
+        pnl_by_date[order["created_at"][:10]] += realized - Decimal(order["paid_fee"])
+    return dict(pnl_by_date), [volume for _, volume in inventory]
+
+
+def test_exact_pnl_equals_decimal_reference(upbit, orders_by_market):
+    for market, orders in orders_by_market.items():
+        expected, _ = decimal_fifo(orders)
+        assert upbit.calculate_real_pnl(orders, exact=True) == expected, market
+
+
+def test_exact_pnl_on_mixed_markets_and_long_history(upbit, order_rows):
+    # One set of units for every market: KRW-BTC PnL is then kept at the
+    # 12 fee decimals of KRW-XRP and must still be exact
+    orders = order_rows * 3
+    expected, _ = decimal_fifo(orders)
+    assert upbit.calculate_real_pnl(orders, exact=True) == expected
+
+
+def test_float_leaves_residue_lots_exact_does_not(orders_by_market):
+    float_residue, exact_residue = [], []
+    for orders in orders_by_market.values():
+        units = market_units(*([o[name] for o in orders] for name in OrderColumns.NUMERIC_FIELDS))
+        float_matcher, exact_matcher = FifoMatcher(), FifoMatcher(units)
+        for order in orders:
+            float_matcher.add_order(order)
+            exact_matcher.add_order(order)
+
+        _, expected_lots = decimal_fifo(orders)
+        exact_lots = [Decimal(volume).scaleb(-units[1]) for _, volume, _ in exact_matcher.inventory]
+        assert exact_lots == expected_lots
+
+        # Below 1 satoshi: not a real lot, only float rounding left over
+        float_residue += [v for _, v, _ in float_matcher.inventory if 0 < v < 1e-8]
+        exact_residue += [v for v in exact_lots if 0 < v < Decimal("1e-8")]
+
+    assert float_residue
+    assert not exact_residue
+
+
+def test_unit_columns_match_to_units():
+    values = ["1.5", "0.25", ".5", "12", "-0.25", "3056.832103720395", "123456789.123456789"]
+    columns = OrderColumns(exact=True)
+    columns.append_page([{"uuid": str(i), "side": "bid", "created_at": "2025-01-01T00:00:00+09:00",
+                          "price": v, "executed_volume": v, "paid_fee": v} for i, v in enumerate(values)])
+    units, numeric = columns.unit_columns()
+    assert units == (12, 12, 24)
+    assert numeric["price"].tolist() == [to_units(v, 12) for v in values]
+    assert numeric["paid_fee"].tolist() == [to_units(v, 24) for v in values]
+
+
+def test_to_units_rejects_extra_decimals():
+    with pytest.raises(ValueError):
+        to_units("1.123", 2)
+    assert to_units("1.120", 2) == 112
+
+
+def test_unit_columns_handle_exponents():
+    columns = OrderColumns(exact=True)
+    columns.append_page([{"uuid": "a", "side": "bid", "created_at": "2025-01-01T00:00:00+09:00",
+                          "price": "1e3", "executed_volume": "1.5E-7", "paid_fee": 0}])
+    units, numeric = columns.unit_columns()
+    assert units == (0, 8, 8)
+    assert [numeric[name].tolist() for name in OrderColumns.NUMERIC_FIELDS] == [[1000], [15], [0]]
@@ -0,0 +1,86 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import yearly_profit_class
+
+ORDERS = [
+    {"uuid": "A", "side": "bid", "ord_type": "limit", "state": "done", "price": "100",
+     "avg_price": "100", "volume": "1.5", "executed_volume": "1.5", "paid_fee": "0.075",
+     "trades_count": 1, "created_at": "2025-10-09T09:00:00+09:00"},
+    {"uuid": "B", "side": "ask", "ord_type": "limit", "state": "done", "price": "130",
+     "avg_price": "130", "volume": "1", "executed_volume": "1", "paid_fee": "0.065",
+     "trades_count": 1, "created_at": "2025-10-09T11:00:00+09:00"},
+]
+
+
+@pytest.fixture
+def upbit(upbit):
+    upbit.collect_all_orders = lambda market: (list(ORDERS), True)
+    return upbit
+
+
+def test_second_export_writes_nothing(upbit, tmp_path):
+    assert upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path)) == {"orders": 1, "lots": 1, "pnl_by_day": 1}
+    assert upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path)) == {"orders": 0, "lots": 0, "pnl_by_day": 0}
+
+
+def test_orphaned_temp_file_is_not_read(upbit, tmp_path, monkeypatch):
+    upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path))
+
+    # Crash between writing the temp file and renaming it into place
+    def crash(src, dst):
+        raise OSError("killed")
+
+    ORDERS.append(dict(ORDERS[1], uuid="C", created_at="2025-10-09T12:00:00+09:00"))
+    try:
+        monkeypatch.setattr(yearly_profit_class.os, "replace", crash)
+        with pytest.raises(OSError):
+            upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path))
+    finally:
+        ORDERS.pop()
+
+    partition = tmp_path / "orders" / "market=KRW-BTC" / "year=2025"
+    assert sorted(os.listdir(partition)) == [".part-0.parquet.tmp", "part-0.parquet"]
+    assert pd.read_parquet(tmp_path / "orders")["uuid"].tolist() == ["A", "B"]
+
+
+def test_incomplete_history_keeps_previous_partitions(upbit, tmp_path):
+    upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path))
+    before = {table: pd.read_parquet(tmp_path / table) for table in ("orders", "lots", "pnl_by_day")}
+
+    # A later page fails: only A comes back, B (the sell) is missing
+    upbit.collect_all_orders = lambda market: ([ORDERS[0]], False)
+    assert upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path)) == {"orders": 0, "lots": 0, "pnl_by_day": 0}
+
+    for table, df in before.items():
+        pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / table), df)
+    assert len(before["lots"]) == 1
+
+
+def test_failed_write_leaves_every_table_unchanged(upbit, tmp_path, monkeypatch):
+    upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path))
+    before = {table: pd.read_parquet(tmp_path / table) for table in ("orders", "lots", "pnl_by_day")}
+
+    # Orders are staged, then writing the lots fails
+    to_parquet = pd.DataFrame.to_parquet
+
+    def fail_on_lots(df, path, **kwargs):
+        if os.sep + "lots" + os.sep in str(path):
+            raise OSError("disk full")
+        return to_parquet(df, path, **kwargs)
+
+    ORDERS.append(dict(ORDERS[1], uuid="C", created_at="2025-10-09T12:00:00+09:00"))
+    try:
+        monkeypatch.setattr(pd.DataFrame, "to_parquet", fail_on_lots)
+        with pytest.raises(OSError):
+            upbit.export_snapshot(["KRW-BTC"], root=str(tmp_path))
+    finally:
+        ORDERS.pop()
+    monkeypatch.undo()
+
+    for table, df in before.items():
+        pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / table), df)
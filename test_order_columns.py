@@ -0,0 +1,22 @@
+import pytest
+
+from yearly_profit_class import OrderColumns
+
+
+@pytest.mark.parametrize("capacity", [0, 1, 7, 1000])
+def test_append_page_grows_from_any_capacity(capacity, orders_by_market):
+    orders = orders_by_market["KRW-BTC"]
+    columns = OrderColumns(capacity=capacity)
+    for i in range(0, len(orders), 10):
+        columns.append_page(orders[i:i + 10])
+
+    assert len(columns) == len(orders)
+    assert list(columns["uuid"]) == [o["uuid"] for o in orders]
+    assert columns["paid_fee"].tolist() == [float(o["paid_fee"]) for o in orders]
+
+
+def test_columns_pnl_matches_dict_pnl(upbit, orders_by_market):
+    for market, orders in orders_by_market.items():
+        columns = OrderColumns()
+        columns.append_page(orders)
+        assert upbit.calculate_columns_pnl(columns) == upbit.calculate_real_pnl(orders)
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+import yearly_profit_class
+
+
+def make_orders(n):
+    """n alternating bid/ask orders, newest first like /v1/orders."""
+    orders = []
+    for i in range(n):
+        orders.append({
+            "uuid": f"order-{i}",
+            "side": "bid" if i % 2 == 0 else "ask",
+            "price": str(1000 + i * 10),
+            "executed_volume": "0.5",
+            "paid_fee": "0.25",
+            "created_at": f"2025-01-{1 + i // 10:02d}T{i % 10:02d}:00:00+09:00",
+        })
+    return orders[::-1]
+
+
+class FakeOrders:
+    """Serves pages of 100 and fails the listed page numbers once each."""
+
+    def __init__(self, orders, fail_pages=()):
+        self.orders = orders
+        self.fail_pages = set(fail_pages)
+        self.calls = []
+
+    def __call__(self, market, page=1):
+        self.calls.append(page)
+        if page in self.fail_pages:
+            self.fail_pages.discard(page)
+            return None
+        return self.orders[(page - 1) * 100:page * 100]
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(yearly_profit_class.time, "sleep", lambda s: None)
+
+
+@pytest.fixture
+def make_api(make_upbit):
+    """UpbitAPI serving /v1/orders pages from fake."""
+    def make(fake, **kwargs):
+        upbit = make_upbit(**kwargs)
+        upbit.get_order_list = fake
+        return upbit
+    return make
+
+
+def test_failed_page_is_not_cached(make_api, tmp_path):
+    orders = make_orders(250)
+    expected = dict(make_api(FakeOrders(orders)).calculate_real_pnl(orders))
+
+    # A partial history is neither cached nor reported
+    fake = FakeOrders(orders, fail_pages=[3])
+    upbit = make_api(fake, cache_dir=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        upbit.get_market_pnl("KRW-BTC")
+    assert os.listdir(tmp_path) == []
+
+    # The API recovered
+    fake = FakeOrders(orders)
+    upbit = make_api(fake, cache_dir=str(tmp_path))
+    assert upbit.get_market_pnl("KRW-BTC") == pytest.approx(expected)
+    assert fake.calls == [1, 2, 3]
+
+
+def test_failed_first_page_serves_last_cached_entry(make_api, tmp_path):
+    orders = make_orders(250)
+    upbit = make_api(FakeOrders(orders), cache_dir=str(tmp_path))
+    first = upbit.get_market_pnl("KRW-BTC")
+
+    # The newer order cannot be seen: the last good result is served
+    upbit.get_order_list = FakeOrders(make_orders(251), fail_pages=[1])
+    assert upbit.get_market_pnl("KRW-BTC") == first
+
+    # Also from the disk tier after a restart
+    restarted = make_api(FakeOrders(orders, fail_pages=[1]), cache_dir=str(tmp_path))
+    assert restarted.get_market_pnl("KRW-BTC") == first
+
+    # No cached entry for the mode: raise instead of reporting no PnL
+    with pytest.raises(RuntimeError):
+        make_api(FakeOrders(orders, fail_pages=[1])).get_market_pnl("KRW-BTC")
+
+
+def test_failed_first_page_does_not_serve_expired_entry(make_api, tmp_path, monkeypatch):
+    orders = make_orders(250)
+    upbit = make_api(FakeOrders(orders), cache_dir=str(tmp_path), cache_ttl=60)
+    upbit.get_market_pnl("KRW-BTC")
+
+    now = yearly_profit_class.time.time()
+    monkeypatch.setattr(yearly_profit_class.time, "time", lambda: now + 61)
+    upbit.get_order_list = FakeOrders(orders, fail_pages=[1])
+    with pytest.raises(RuntimeError):
+        upbit.get_market_pnl("KRW-BTC")
+
+
+def test_cache_hit_fetches_only_first_page(make_api, tmp_path):
+    orders = make_orders(250)
+    fake = FakeOrders(orders)
+    upbit = make_api(fake, cache_dir=str(tmp_path))
+
+    first = upbit.get_market_pnl("KRW-BTC")
+    fake.calls.clear()
+    assert upbit.get_market_pnl("KRW-BTC") == first
+    assert fake.calls == [1]
+
+    # Disk tier survives a restart
+    fake = FakeOrders(orders)
+    assert make_api(fake, cache_dir=str(tmp_path)).get_market_pnl("KRW-BTC") == first
+    assert fake.calls == [1]
+
+
+def test_new_order_invalidates_and_evicts_old_disk_entry(make_api, tmp_path):
+    orders = make_orders(250)
+    upbit = make_api(FakeOrders(orders), cache_dir=str(tmp_path))
+    upbit.get_market_pnl("KRW-BTC")
+
+    newer = make_orders(251)
+    fake = FakeOrders(newer)
+    upbit.get_order_list = fake
+    assert upbit.get_market_pnl("KRW-BTC") == pytest.approx(dict(upbit.calculate_real_pnl(newer)))
+    assert fake.calls == [1, 2, 3]
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_entries_expire_after_ttl(make_api, tmp_path, monkeypatch):
+    orders = make_orders(250)
+    fake = FakeOrders(orders)
+    upbit = make_api(fake, cache_dir=str(tmp_path), cache_ttl=60)
+    upbit.get_market_pnl("KRW-BTC")
+
+    now = yearly_profit_class.time.time()
+    monkeypatch.setattr(yearly_profit_class.time, "time", lambda: now + 61)
+    fake.calls.clear()
+    upbit.get_market_pnl("KRW-BTC")
+    assert fake.calls == [1, 2, 3]
+
+
+def test_exact_and_float_are_cached_separately(make_api, tmp_path):
+    orders = make_orders(250)
+    fake = FakeOrders(orders)
+    upbit = make_api(fake, cache_dir=str(tmp_path))
+
+    approx = upbit.get_market_pnl("KRW-BTC")
+    exact = upbit.get_market_pnl("KRW-BTC", exact=True)
+    assert exact == dict(upbit.calculate_real_pnl(orders, exact=True))
+    assert {type(v) for v in exact.values()} == {yearly_profit_class.Decimal}
+    assert exact == pytest.approx(approx)
+    assert len(os.listdir(tmp_path)) == 2
+
+    fake.calls.clear()
+    assert upbit.get_market_pnl("KRW-BTC", exact=True) == exact
+    assert fake.calls == [1]
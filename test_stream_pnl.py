@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+websockets = pytest.importorskip("websockets")
+pytest.importorskip("websocket")
+
+import yearly_profit_class
+
+# /v1/orders records: A (bid) is history, C (bid) was placed before B (ask)
+# but only filled while the socket was down
+ORDER_A = {"uuid": "A", "side": "bid", "price": "100", "executed_volume": "1.5",
+           "paid_fee": "0.075", "created_at": "2025-10-09T09:00:00+09:00"}
+ORDER_C = {"uuid": "C", "side": "bid", "price": "110", "executed_volume": "1",
+           "paid_fee": "0.055", "created_at": "2025-10-09T10:00:00+09:00"}
+ORDER_B = {"uuid": "B", "side": "ask", "price": "130", "executed_volume": "2",
+           "paid_fee": "0.13", "created_at": "2025-10-09T11:00:00+09:00"}
+
+
+def my_order(order, state="done"):
+    """The myOrder event Upbit would push for a /v1/orders record."""
+    ts = yearly_profit_class.datetime.fromisoformat(order["created_at"]).timestamp()
+    return {
+        "type": "myOrder", "code": "KRW-BTC", "uuid": order["uuid"],
+        "ask_bid": order["side"].upper(), "order_type": "limit", "state": state,
+        "price": float(order["price"]), "avg_price": float(order["price"]),
+        "volume": float(order["executed_volume"]), "remaining_volume": 0,
+        "executed_volume": float(order["executed_volume"]), "trades_count": 1,
+        "paid_fee": float(order["paid_fee"]), "order_timestamp": int(ts * 1000),
+    }
+
+
+@pytest.fixture
+def stand_in():
+    """
+    Local WebSocket stand-in for the private endpoint. Each connection pops
+    one scripted session (a list of messages), sends it and closes.
+    """
+    sessions = []
+    subscriptions = []
+
+    async def handler(ws):
+        subscriptions.append(json.loads(await ws.recv()))
+        for msg in sessions.pop(0) if sessions else []:
+            await ws.send(json.dumps(msg).encode())
+        await ws.close()
+
+    async def start():
+        return await websockets.serve(handler, "localhost", 0, close_timeout=0.1)
+
+    async def stop():
+        server.close()
+        await server.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = asyncio.run_coroutine_threadsafe(start(), loop).result(5)
+    port = server.sockets[0].getsockname()[1]
+
+    yield f"ws://localhost:{port}", sessions, subscriptions
+
+    asyncio.run_coroutine_threadsafe(stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(yearly_profit_class.time, "sleep", lambda s: None)
+
+
+class FakeRest:
+    """
+    collect_all_orders stand-in. Each done-order fetch serves the next of
+    `histories` (None: a page failed); `open_orders` are the waiting ones.
+    """
+
+    def __init__(self, *histories, open_orders=()):
+        self.histories = list(histories)
+        self.open_orders = list(open_orders)
+        self.since = []
+
+    def __call__(self, market, first_page=None, state="done", since=None):
+        if state == "wait":
+            return list(self.open_orders), True
+        self.since.append(since)
+        history = self.histories.pop(0) if len(self.histories) > 1 else self.histories[0]
+        if history is None:
+            return [], False
+        return list(history), True
+
+
+def test_stream_updates_pnl_from_done_events(stand_in, upbit):
+    ws_url, sessions, subscriptions = stand_in
+    sessions.append([my_order(ORDER_C), my_order(ORDER_B)])
+    upbit.collect_all_orders = FakeRest([ORDER_A])
+
+    updates = []
+    matchers = upbit.stream_pnl(
+        ["KRW-BTC"], on_update=lambda *args: updates.append(args[1]["uuid"]),
+        ws_url=ws_url, max_retries=0,
+    )
+
+    assert subscriptions[0][1] == {"type": "myOrder", "codes": ["KRW-BTC"]}
+    assert updates == ["C", "B"]
+    expected = upbit.calculate_real_pnl([ORDER_A, ORDER_B, ORDER_C])
+    assert matchers["KRW-BTC"].pnl_by_date == pytest.approx(expected)
+
+
+def test_reconnect_backfills_late_fill_in_created_at_order(stand_in, upbit):
+    ws_url, sessions, _ = stand_in
+    sessions.append([my_order(ORDER_B)])  # then the socket drops
+    sessions.append([])                   # reconnect, nothing new on the socket
+
+    # C was open at the disconnect and completed during the gap;
+    # it sorts before B by created_at
+    rest = FakeRest([ORDER_A], [ORDER_B, ORDER_C, ORDER_A], open_orders=[ORDER_C])
+    upbit.collect_all_orders = rest
+
+    updates = []
+    matchers = upbit.stream_pnl(
+        ["KRW-BTC"], on_update=lambda *args: updates.append(args[1]["uuid"]),
+        ws_url=ws_url, max_retries=1,
+    )
+
+    # B is not counted twice, C is picked up from REST
+    assert updates == ["B", "C"]
+    expected = upbit.calculate_real_pnl([ORDER_A, ORDER_B, ORDER_C])
+    assert matchers["KRW-BTC"].pnl_by_date == pytest.approx(expected)
+    assert list(matchers["KRW-BTC"].inventory) == [(110.0, 0.5, "2025-10-09")]
+
+    # The first connection loads the full history, the reconnect only
+    # back to the oldest order that was still open
+    assert rest.since == [None, ORDER_C["created_at"]]
+
+
+def test_failed_backfill_page_is_retried(stand_in, upbit):
+    ws_url, sessions, _ = stand_in
+    sessions.extend([[my_order(ORDER_B)], [], []])
+    upbit.collect_all_orders = FakeRest([ORDER_A], None, [ORDER_B, ORDER_C, ORDER_A])
+
+    updates = []
+    matchers = upbit.stream_pnl(
+        ["KRW-BTC"], on_update=lambda *args: updates.append(args[1]["uuid"]),
+        ws_url=ws_url, max_retries=2,
+    )
+
+    assert updates == ["B", "C"]
+    expected = upbit.calculate_real_pnl([ORDER_A, ORDER_B, ORDER_C])
+    assert matchers["KRW-BTC"].pnl_by_date == pytest.approx(expected)
+
+
+def test_failed_seed_page_is_retried(stand_in, upbit):
+    ws_url, sessions, _ = stand_in
+    sessions.extend([[], [my_order(ORDER_B)]])
+    upbit.collect_all_orders = FakeRest(None, [ORDER_A])
+
+    matchers = upbit.stream_pnl(["KRW-BTC"], ws_url=ws_url, max_retries=1)
+
+    expected = upbit.calculate_real_pnl([ORDER_A, ORDER_B])
+    assert matchers["KRW-BTC"].pnl_by_date == pytest.approx(expected)
+
+
+def test_ping_replies_do_not_reset_retries(stand_in, upbit):
+    ws_url, sessions, subscriptions = stand_in
+    sessions.extend([[{"status": "UP"}]] * 4)
+    upbit.collect_all_orders = FakeRest([])
+
+    upbit.stream_pnl(["KRW-BTC"], ws_url=ws_url, max_retries=1)
+
+    assert len(subscriptions) == 2
+
+
+def test_open_order_events_are_tracked_not_matched(stand_in, upbit):
+    ws_url, sessions, _ = stand_in
+    sessions.append([my_order(ORDER_C, state="wait"), my_order(ORDER_C)])
+    upbit.collect_all_orders = FakeRest([ORDER_A])
+
+    updates = []
+    upbit.stream_pnl(
+        ["KRW-BTC"], on_update=lambda *args: updates.append(args[1]["uuid"]),
+        ws_url=ws_url, max_retries=0,
+    )
+
+    assert updates == ["C"]
+
+
+def test_backfill_stops_paging_at_since(make_upbit):
+    history = [dict(ORDER_A, uuid=str(i), created_at=f"2025-10-{9 - i // 100:02d}T09:00:00+09:00")
+               for i in range(250)]
+    calls = []
+
+    def get_order_list(market, page=1, state="done"):
+        calls.append(page)
+        return history[(page - 1) * 100:page * 100]
+
+    upbit = make_upbit()
+    upbit.get_order_list = get_order_list
+    orders, complete = upbit.collect_all_orders("KRW-BTC", since="2025-10-09T00:00:00+09:00")
+
+    assert complete and calls == [1, 2]
+    assert len(orders) == 200
+
+
+def test_stream_stops_after_max_retries(stand_in, upbit):
+    ws_url, sessions, subscriptions = stand_in
+    upbit.collect_all_orders = FakeRest([])
+
+    upbit.stream_pnl(["KRW-BTC"], ws_url=ws_url, max_retries=2)
+
+    assert len(subscriptions) == 3
+
+
+def test_exact_stream_matches_exact_batch(stand_in, upbit):
+    ws_url, sessions, _ = stand_in
+    sessions.append([my_order(ORDER_C), my_order(ORDER_B)])
+    upbit.collect_all_orders = FakeRest([ORDER_A])
+
+    updates = []
+    matchers = upbit.stream_pnl(
+        ["KRW-BTC"], on_update=lambda *args: updates.append(args[3]),
+        ws_url=ws_url, max_retries=0, exact=True,
+    )
+
+    assert updates == [0, yearly_profit_class.Decimal("54.87")]
+    expected = upbit.calculate_real_pnl([ORDER_A, ORDER_B, ORDER_C], exact=True)
+    assert matchers["KRW-BTC"].pnl_amounts() == expected
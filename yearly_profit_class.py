@@ -1,27 +1,322 @@
 import os
+import sys
+import json
 import time
 import uuid
+import bisect
+import pickle
+import glob
 import hashlib
 import requests
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlencode
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
 from dotenv import load_dotenv
 import jwt
 
+try:
+    import orjson  # pip install orjson (optional, faster page decoding)
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # Load .env if available
 load_dotenv()
 
+# Upbit timestamps are reported in Korea Standard Time
+KST = timezone(timedelta(hours=9))
+
+
+# Exact units (price decimals, volume decimals, PnL decimals) for the stream,
+# where they must be fixed before a market's orders are seen. Upbit volumes
+# have at most 8 decimals (1 satoshi for BTC); a fee is price × volume × 0.05%,
+# so it needs up to 4 more decimals than their product.
+DEFAULT_UNITS = (8, 8, 20)
+
+
+def to_units(value, decimals):
+    """
+    Parse a decimal string into an integer count of 10^-decimals units,
+    without going through float. e.g. ('0.04506786', 8) → 4506786
+    """
+    text = str(value)
+    if "e" in text or "E" in text:
+        text = format(Decimal(text), "f")
+
+    sign = -1 if text.startswith("-") else 1
+    whole, _, frac = text.lstrip("+-").partition(".")
+    if len(frac) > decimals and frac[decimals:].strip("0"):
+        raise ValueError(f"{value!r} has more than {decimals} decimal places")
+    return sign * int((whole or "0") + frac[:decimals].ljust(decimals, "0"))
+
+
+def from_units(units, decimals):
+    """
+    Inverse of to_units: an integer count of 10^-decimals units as an exact
+    Decimal. e.g. (4506786, 8) → Decimal('0.04506786')
+    """
+    return Decimal(units).scaleb(-decimals)
+
+
+def _max_decimals(values):
+    """Most digits after the decimal point among the values."""
+    places = 0
+    for value in values:
+        text = str(value)
+        if "e" in text or "E" in text:
+            text = format(Decimal(text), "f")
+        if "." in text:
+            places = max(places, len(text) - text.index(".") - 1)
+    return places
+
+
+def market_units(prices, volumes, fees):
+    """
+    Smallest exact units for one market: (price, volume, PnL) decimals.
+    Each is the most decimals that market actually reports, so KRW-BTC
+    volumes use satoshis while a coin quoted in whole units stays small.
+    PnL units cover both price × volume and the fees.
+    """
+    price_decimals = _max_decimals(prices)
+    volume_decimals = _max_decimals(volumes)
+    return price_decimals, volume_decimals, max(price_decimals + volume_decimals, _max_decimals(fees))
+
+
+# ==========================================================
+# Incremental FIFO Matcher
+# ==========================================================
+class FifoMatcher:
+    """
+    FIFO matching of buy → sell that can be fed one order at a time.
+    Orders must arrive in time order; realized PnL accumulates per day.
+
+    With units = (price, volume, PnL decimals) set, amounts are held as
+    scaled integers so matching is exact, and pnl_by_date is kept in
+    10^-pnl_decimals KRW units (see pnl_amounts). Otherwise plain floats.
+
+    With record_lots, every buy → sell match is kept in self.lots as
+    (buy_date, sell_date, buy_price, sell_price, volume).
+    """
+
+    def __init__(self, units=None, record_lots=False):
+        self.units = units
+        self.lots = [] if record_lots else None
+        self.inventory = deque()
+        self.pnl_by_date = defaultdict(int if units is not None else float)
+
+        # price × volume has price + volume decimals; lift it to PnL units
+        self._realized_scale = 1
+        if units is not None:
+            self._realized_scale = 10 ** (units[2] - units[0] - units[1])
+
+    def amount(self, pnl):
+        """A PnL value from this matcher in KRW (Decimal when exact)."""
+        if self.units is None:
+            return pnl
+        return from_units(pnl, self.units[2])
+
+    def pnl_amounts(self):
+        """Returns: dict { 'YYYY-MM-DD': pnl in KRW } (Decimal when exact)"""
+        return {date: self.amount(pnl) for date, pnl in self.pnl_by_date.items()}
+
+    def add_order(self, order):
+        """
+        Push one /v1/orders-shaped record through the matcher.
+        Returns: ('YYYY-MM-DD', realized pnl of this order)
+        """
+        # ISO timestamps carry the local (KST) date in their first 10 characters
+        date_str = order["created_at"][:10]
+
+        if self.units is not None:
+            price_decimals, volume_decimals, pnl_decimals = self.units
+            executed_volume = to_units(order["executed_volume"], volume_decimals)
+            price = to_units(order["price"], price_decimals)
+            fee = to_units(order["paid_fee"], pnl_decimals)
+        else:
+            executed_volume = float(order["executed_volume"])
+            price = float(order["price"])
+            fee = float(order["paid_fee"])
+
+        return self.add(date_str, order["side"], price, executed_volume, fee)
+
+    def add(self, date_str, side, price, executed_volume, fee):
+        """
+        Push already-parsed order fields through the matcher.
+        Returns: ('YYYY-MM-DD', realized pnl of this order)
+        """
+        if side == "bid":   # Buy
+            self.inventory.append((price, executed_volume, date_str))
+            return date_str, 0.0
+
+        if side != "ask":
+            return date_str, 0.0
+
+        # Sell
+        remaining = executed_volume
+        realized = 0
+
+        # FIFO match against inventory
+        while remaining > 0 and self.inventory:
+            buy_price, buy_volume, buy_date = self.inventory.popleft()
+            matched = min(remaining, buy_volume)
+            realized += (price - buy_price) * matched
+
+            if self.lots is not None:
+                self.lots.append((buy_date, date_str, buy_price, price, matched))
+
+            if buy_volume > matched:
+                self.inventory.appendleft((buy_price, buy_volume - matched, buy_date))
+
+            remaining -= matched
+
+        pnl = realized * self._realized_scale - fee
+        self.pnl_by_date[date_str] += pnl
+        return date_str, pnl
+
+
+# ==========================================================
+# Columnar Order Buffers
+# ==========================================================
+class OrderColumns:
+    """
+    Preallocated column buffers holding only the order fields the PnL needs.
+    Numeric strings are converted to float64 a whole page at a time.
+    With exact=True they are kept as text and parsed into integer units
+    by unit_columns().
+    """
+    NUMERIC_FIELDS = ("price", "executed_volume", "paid_fee")
+    TEXT_FIELDS = ("uuid", "side", "created_at")
+
+    def __init__(self, capacity=1000, exact=False):
+        self.size = 0
+        self.exact = exact
+        numeric_dtype = object if exact else np.float64
+        self._buffers = {name: np.empty(capacity, dtype=numeric_dtype) for name in self.NUMERIC_FIELDS}
+        for name in self.TEXT_FIELDS:
+            self._buffers[name] = np.empty(capacity, dtype=object)
+
+    def _reserve(self, n):
+        capacity = len(self._buffers["price"])
+        if self.size + n <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + n)
+        for name, buf in self._buffers.items():
+            grown = np.empty(capacity, dtype=buf.dtype)
+            grown[:self.size] = buf[:self.size]
+            self._buffers[name] = grown
+
+    def append_page(self, orders):
+        """Append one decoded /v1/orders page (list of dicts)."""
+        n = len(orders)
+        if not n:
+            return
+        self._reserve(n)
+        start, end = self.size, self.size + n
+
+        # numpy parses the decimal strings in C on assignment
+        for name in self.NUMERIC_FIELDS + self.TEXT_FIELDS:
+            self._buffers[name][start:end] = [order[name] for order in orders]
+        self.size = end
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        return self._buffers[name][:self.size]
+
+    def unit_columns(self):
+        """
+        Exact-mode numeric columns as integer units (see market_units).
+        Returns: (units, { field: object array of int })
+        """
+        units = market_units(self["price"], self["executed_volume"], self["paid_fee"])
+        return units, {
+            name: np.array([to_units(value, decimals) for value in self[name]], dtype=object)
+            for name, decimals in zip(self.NUMERIC_FIELDS, units)
+        }
+
+
+# ==========================================================
+# Backtest Worker (module level so it can run in a process pool)
+# ==========================================================
+FEE_RATE = 0.0005  # Upbit KRW market fee, 0.05% (see paid_fee.py)
+
+
+def _rolling_means(close, windows):
+    """Simple moving averages of close for each window → { window: array }"""
+    csum = np.concatenate(([0.0], np.cumsum(close)))
+    means = {}
+    for w in windows:
+        sma = np.full(len(close), np.nan)
+        sma[w - 1:] = (csum[w:] - csum[:-w]) / w
+        means[w] = sma
+    return means
+
+
+def _backtest_worker(task):
+    """
+    Runs one market over a chunk of (short, long) moving-average pairs.
+    Signals for the whole chunk are computed as one (pairs × candles) matrix;
+    each resulting trade is pushed through FifoMatcher.add as plain floats.
+    Returns: list of (market, short, long, trades, pnl)
+    """
+    market, created_at, close, params, notional, fee_rate = task
+    shorts = np.array([p[0] for p in params])
+    longs = np.array([p[1] for p in params])
+    means = _rolling_means(close, set(shorts) | set(longs))
+
+    short_ma = np.stack([means[w] for w in shorts])
+    long_ma = np.stack([means[w] for w in longs])
+    holding = (short_ma > long_ma).astype(np.int8)  # NaN compares False
+    signals = np.diff(holding, axis=1, prepend=0)    # +1 buy, -1 sell
+
+    volumes = (np.floor(notional / close * 1e8) / 1e8).tolist()
+    prices = close.tolist()
+
+    results = []
+    for i, (short, long_) in enumerate(params):
+        matcher = FifoMatcher()
+        trades = 0
+        volume = None
+        for t in np.flatnonzero(signals[i]):
+            if signals[i, t] > 0:
+                volume = volumes[t]
+                side = "bid"
+            elif volume is not None:
+                side = "ask"
+            else:
+                continue
+
+            matcher.add(created_at[t][:10], side, prices[t], volume, prices[t] * volume * fee_rate)
+            trades += 1
+
+        results.append((market, short, long_, trades, sum(matcher.pnl_by_date.values())))
+    return results
+
 
 class UpbitAPI:
     BASE_URL = "https://api.upbit.com"
+    WS_URL = "wss://api.upbit.com/websocket/v1/private"
+    WS_PING_INTERVAL = 60  # Upbit closes idle sockets after 120s
+    BACKFILL_MARGIN = 300  # seconds of clock skew allowed when bounding a backfill
 
-    def __init__(self, access_key=None, secret_key=None):
+    def __init__(self, access_key=None, secret_key=None, cache_size=32, cache_dir=None,
+                 cache_ttl=300):
         self.access_key = access_key or os.getenv("UPBIT_OPEN_API_ACCESS_KEY")
         self.secret_key = secret_key or os.getenv("UPBIT_OPEN_API_SECRET_KEY")
         if not (self.access_key and self.secret_key):
             raise ValueError("Access/Secret keys must be provided or set in env variables.")
 
+        # Per-market PnL cache: (market, watermark) → (saved_at, pnl_by_date)
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self._pnl_cache = OrderedDict()
+
     # ----------------------------------------------------------
     # Authorization Token
     # ----------------------------------------------------------
@@ -49,93 +344,646 @@ class UpbitAPI:
     # ----------------------------------------------------------
     # Order Fetching
     # ----------------------------------------------------------
-    def get_order_list(self, market, page=1):
+    def _request_order_page(self, market, page, state="done"):
         url = f"{self.BASE_URL}/v1/orders"
         query = {
             'market': market,
-            'state': 'done',
+            'state': state,
             'page': page,
             'order_by': 'desc',
             'limit': 100,
         }
         headers = {'Authorization': self._get_authorization_token(query)}
-        r = requests.get(url, headers=headers, params=query)
+        return requests.get(url, headers=headers, params=query)
+
+    def get_order_list(self, market, page=1, state="done"):
+        """
+        One page of orders in `state` ('done', or 'wait' for open ones),
+        newest created first.
+        Returns None (not []) when the request failed, so callers can tell
+        an error apart from the end of the history.
+        """
+        r = self._request_order_page(market, page, state)
 
         if r.status_code == 200:
-            return r.json()
+            return _json_loads(r.content)
         else:
             print("❌ API Error:", r.json())
-            return []
+            return None
 
-    def collect_all_orders(self, market):
+    def collect_all_orders(self, market, first_page=None, state="done", since=None):
+        """
+        Pages through /v1/orders, newest created first.
+        With since (an ISO created_at), paging stops after the first page
+        whose orders were all created before it.
+        Returns: (orders, complete) — complete is False if a page failed
+        """
         all_orders = []
         page = 1
         while True:
-            orders = self.get_order_list(market, page)
+            if page == 1 and first_page is not None:
+                orders = first_page
+            else:
+                orders = self.get_order_list(market, page, state)
+            if orders is None:
+                return all_orders, False
             if not orders:
                 break
             all_orders.extend(orders)
+            if len(orders) < 100:
+                break
+            if since is not None and all(o["created_at"] < since for o in orders):
+                break
+            page += 1
+            time.sleep(0.2)
+        return all_orders, True
+
+    def collect_order_columns(self, market, first_page=None, exact=False):
+        """
+        Same full paging as collect_all_orders, but each page is decoded
+        straight into OrderColumns instead of being kept as dicts.
+        Returns: (OrderColumns, complete) — complete is False if a page failed
+        """
+        columns = OrderColumns(exact=exact)
+        page = 1
+        while True:
+            if page == 1 and first_page is not None:
+                orders = first_page
+            else:
+                orders = self.get_order_list(market, page)
+            if orders is None:
+                return columns, False
+            if not orders:
+                break
+            columns.append_page(orders)
             if len(orders) < 100:
                 break
             page += 1
             time.sleep(0.2)
-        return all_orders
+        return columns, True
 
     # ----------------------------------------------------------
     # FIFO Realized PnL Calculator
     # ----------------------------------------------------------
-    def calculate_real_pnl(self, orders):
+    def calculate_real_pnl(self, orders, exact=False):
         """
         Calculate realized PnL using FIFO matching of buy → sell.
-        Returns: dict { 'YYYY-MM-DD': pnl_value }
+        exact=True matches in scaled-integer units chosen per market
+        instead of floats, so no rounding residue is left in the inventory.
+        Returns: dict { 'YYYY-MM-DD': pnl_value } (Decimal values when exact)
         """
-        inventory = deque()
-        pnl_by_date = defaultdict(float)
+        if exact:
+            columns = OrderColumns(capacity=len(orders), exact=True)
+            columns.append_page(orders)
+            return self.calculate_columns_pnl(columns, exact=True)
 
+        matcher = FifoMatcher()
         for order in sorted(orders, key=lambda x: x["created_at"]):
-            created_at = pd.to_datetime(order["created_at"])
-            date_str = created_at.strftime("%Y-%m-%d")
+            matcher.add_order(order)
+        return matcher.pnl_by_date
 
-            executed_volume = float(order["executed_volume"])
-            price = float(order["price"])
-            fee = float(order["paid_fee"])
+    def calculate_columns_pnl(self, columns, exact=False):
+        """
+        calculate_real_pnl for OrderColumns (built with exact=True for exact).
+        Returns: dict { 'YYYY-MM-DD': pnl_value } (Decimal values when exact)
+        """
+        if exact:
+            units, numeric = columns.unit_columns()
+        else:
+            units, numeric = None, {name: columns[name] for name in OrderColumns.NUMERIC_FIELDS}
+
+        matcher = FifoMatcher(units)
+        created_at = columns["created_at"]
+        order = np.argsort(created_at, kind="stable")
+        values = {name: numeric[name][order].tolist() for name in OrderColumns.NUMERIC_FIELDS}
+
+        # ISO timestamps carry the local date in their first 10 characters
+        for date_str, side, price, volume, fee in zip(
+            (c[:10] for c in created_at[order]),
+            columns["side"][order],
+            values["price"],
+            values["executed_volume"],
+            values["paid_fee"],
+        ):
+            matcher.add(date_str, side, price, volume, fee)
+        return matcher.pnl_amounts() if exact else matcher.pnl_by_date
+
+    # ----------------------------------------------------------
+    # Live PnL via private WebSocket (myOrder)
+    # ----------------------------------------------------------
+    def _order_from_my_order(self, msg):
+        """
+        Convert a myOrder 'done' event into the /v1/orders record shape,
+        so it goes through the same FIFO matcher as REST history.
+        """
+        created_at = datetime.fromtimestamp(msg["order_timestamp"] / 1000, KST)
+        return {
+            "uuid": msg["uuid"],
+            "side": msg["ask_bid"].lower(),
+            "ord_type": msg["order_type"],
+            "price": str(msg["price"]),
+            "avg_price": str(msg["avg_price"]),
+            "state": msg["state"],
+            "market": msg["code"],
+            "created_at": created_at.replace(microsecond=0).isoformat(),
+            "volume": str(msg["volume"]),
+            "remaining_volume": str(msg["remaining_volume"]),
+            "paid_fee": str(msg["paid_fee"]),
+            "executed_volume": str(msg["executed_volume"]),
+            "trades_count": msg["trades_count"],
+        }
+
+    def _ingest_order(self, market, order, matchers, histories, seen, on_update):
+        """
+        Feed one order into the market's matcher in created_at order, the
+        same order calculate_real_pnl uses. An order created before the
+        newest one already matched (e.g. a resting limit order that filled
+        late) is inserted in place and the market is replayed from scratch.
+        """
+        if order["uuid"] in seen:
+            return
+        seen.add(order["uuid"])
+
+        history = histories[market]
+        if not history or order["created_at"] >= history[-1]["created_at"]:
+            history.append(order)
+            date_str, pnl = matchers[market].add_order(order)
+        else:
+            pos = bisect.bisect_right(history, order["created_at"], key=lambda x: x["created_at"])
+            history.insert(pos, order)
+            matcher = FifoMatcher(matchers[market].units)
+            for o in history:
+                result = matcher.add_order(o)
+                if o is order:
+                    date_str, pnl = result
+            matchers[market] = matcher
+
+        if on_update:
+            matcher = matchers[market]
+            on_update(market, order, date_str, matcher.amount(pnl), matcher.pnl_amounts())
+
+    def _backfill_orders(self, markets, matchers, histories, seen, on_update, since=None):
+        """
+        Fetch orders that completed while the socket was down (the whole
+        history when since is None). /v1/orders is sorted by created_at,
+        so paging can stop at `since`: the older of the socket's last sign
+        of life and the oldest order that was still open at that time.
+        Raises ConnectionError if a page failed, so the stream retries.
+        """
+        fetched = {}
+        for market in markets:
+            orders, complete = self.collect_all_orders(market, since=since)
+            if not complete:
+                raise ConnectionError(f"{market}: order backfill incomplete")
+            fetched[market] = orders
+
+        for market, orders in fetched.items():
+            missed = [o for o in orders if o["uuid"] not in seen]
+            for order in sorted(missed, key=lambda x: x["created_at"]):
+                self._ingest_order(market, order, matchers, histories, seen, on_update)
+
+    def _fetch_open_orders(self, markets):
+        """
+        Orders still waiting to fill. Returns: { uuid: created_at }
+        Raises ConnectionError if a page failed, so the stream retries.
+        """
+        open_orders = {}
+        for market in markets:
+            orders, complete = self.collect_all_orders(market, state="wait")
+            if not complete:
+                raise ConnectionError(f"{market}: open orders incomplete")
+            open_orders.update((o["uuid"], o["created_at"]) for o in orders)
+        return open_orders
+
+    def stream_pnl(self, markets, on_update=None, ws_url=None, max_retries=None, exact=False):
+        """
+        Keeps a FIFO matcher per market current from the private myOrder
+        stream as each order completes. Every connection subscribes first
+        and then backfills over REST, so nothing falls in between: the
+        first one loads the full history, later ones only the gap. Orders
+        are de-duplicated by uuid, so overlap between the two is harmless,
+        and a failed REST page counts as a dropped connection (retried).
+        Orders are matched in created_at order, so the running PnL equals
+        calculate_real_pnl over the same orders; a late fill of an older
+        order replays that market and may revise earlier days.
+
+        on_update(market, order, date_str, pnl, pnl_by_date) is called per
+        streamed or backfilled order (not for the initial history).
+        ws_url lets the stream point at a local WebSocket stand-in.
+        exact=True matches in DEFAULT_UNITS and reports Decimal amounts.
+        Returns: dict { market: FifoMatcher } once the stream stops.
+        """
+        import websocket  # pip install websocket-client
+
+        units = DEFAULT_UNITS if exact else None
+        matchers = {market: FifoMatcher(units) for market in markets}
+        histories = {market: [] for market in markets}
+        seen = set()
+
+        subscribe = json.dumps([
+            {"ticket": str(uuid.uuid4())},
+            {"type": "myOrder", "codes": list(markets)},
+            {"format": "DEFAULT"},
+        ])
+
+        retries = 0
+        seeded = False
+        alive_at = None     # last time the socket (or a backfill) covered everything
+        open_orders = {}    # uuid → created_at of orders not yet done
+        while True:
+            ws = None
+            try:
+                ws = websocket.create_connection(
+                    ws_url or self.WS_URL,
+                    header={"Authorization": self._get_authorization_token()},
+                    timeout=self.WS_PING_INTERVAL,
+                )
+                ws.send(subscribe)
+                subscribed_at = time.time()
 
-            if order["side"] == "bid":   # Buy
-                inventory.append((price, executed_volume))
+                # An order done in the gap was created after the socket went
+                # quiet, or was already open then (allow for clock skew)
+                since = None
+                if seeded:
+                    gap_start = datetime.fromtimestamp(alive_at - self.BACKFILL_MARGIN, KST)
+                    since = min([gap_start.replace(microsecond=0).isoformat(), *open_orders.values()])
+                self._backfill_orders(markets, matchers, histories, seen,
+                                      on_update if seeded else None, since)
+                open_orders = self._fetch_open_orders(markets)
+                seeded = True
+                alive_at = subscribed_at
 
-            elif order["side"] == "ask":  # Sell
-                remaining = executed_volume
-                realized = 0.0
+                while True:
+                    try:
+                        raw = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        ws.send("PING")
+                        continue
+                    if not raw:
+                        raise websocket.WebSocketConnectionClosedException("empty frame")
+                    alive_at = time.time()
 
-                # FIFO match against inventory
-                while remaining > 0 and inventory:
-                    buy_price, buy_volume = inventory.popleft()
-                    matched = min(remaining, buy_volume)
-                    realized += (price - buy_price) * matched
+                    # Keep decimals as strings, the same as /v1/orders
+                    msg = json.loads(raw, parse_float=str)
+                    if msg.get("type") != "myOrder":
+                        continue
 
-                    if buy_volume > matched:
-                        inventory.appendleft((buy_price, buy_volume - matched))
+                    # Only a socket that delivers orders counts as recovered,
+                    # not one that just answers PING with {"status": "UP"}
+                    retries = 0
 
-                    remaining -= matched
+                    order = self._order_from_my_order(msg)
+                    if msg.get("state") in ("done", "cancel"):
+                        open_orders.pop(order["uuid"], None)
+                    else:
+                        open_orders[order["uuid"]] = order["created_at"]
+                    if msg.get("state") != "done":
+                        continue
+                    self._ingest_order(order["market"], order, matchers, histories, seen, on_update)
 
-                pnl_by_date[date_str] += realized - fee
+            except (OSError, websocket.WebSocketException) as e:
+                print("⚠️ WebSocket disconnected:", e)
+            except KeyboardInterrupt:
+                break
+            finally:
+                if ws is not None:
+                    ws.close()
+
+            retries += 1
+            if max_retries is not None and retries > max_retries:
+                break
+            time.sleep(min(2 ** retries, 30))
+
+        return matchers
+
+    # ----------------------------------------------------------
+    # PnL Cache (memory LRU + optional disk tier)
+    # ----------------------------------------------------------
+    def _order_watermark(self, first_page):
+        """
+        Version of a market's order history, taken from the newest page.
+        /v1/orders is sorted by created_at, so this catches newly placed
+        orders that filled, but not an old resting order that filled later
+        (it lands on an older page). cache_ttl bounds how long such a miss
+        can be served.
+        """
+        h = hashlib.sha1()
+        for order in first_page:
+            h.update(order["uuid"].encode())
+        return f"{len(first_page)}-{h.hexdigest()}"
+
+    def _cache_path(self, key):
+        market, mode, watermark = key
+        return os.path.join(self.cache_dir, f"pnl-{market}-{mode}-{watermark}.pkl")
+
+    def _cache_expired(self, saved_at):
+        return self.cache_ttl is not None and time.time() - saved_at > self.cache_ttl
+
+    def _cache_get(self, key):
+        if key in self._pnl_cache:
+            saved_at, pnl_dict = self._pnl_cache[key]
+            if not self._cache_expired(saved_at):
+                self._pnl_cache.move_to_end(key)
+                return pnl_dict
+            del self._pnl_cache[key]
+
+        if self.cache_dir:
+            path = self._cache_path(key)
+            if os.path.exists(path):
+                saved_at = os.path.getmtime(path)
+                if self._cache_expired(saved_at):
+                    os.remove(path)
+                    return None
+                with open(path, "rb") as f:
+                    pnl_dict = pickle.load(f)
+                self._cache_put(key, pnl_dict, saved_at=saved_at, write_disk=False)
+                return pnl_dict
+        return None
 
-        return pnl_by_date
+    def _cache_put(self, key, pnl_dict, saved_at=None, write_disk=True):
+        self._pnl_cache[key] = (saved_at or time.time(), pnl_dict)
+        self._pnl_cache.move_to_end(key)
+        while len(self._pnl_cache) > self.cache_size:
+            self._pnl_cache.popitem(last=False)
+
+        if write_disk and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(pnl_dict, f)
+            os.replace(tmp_path, path)
+
+            # Only the newest watermark of a market can be hit again
+            market, mode, _ = key
+            for old_path in glob.glob(os.path.join(self.cache_dir, f"pnl-{market}-{mode}-*.pkl")):
+                if old_path != path:
+                    os.remove(old_path)
+
+    def _cache_latest(self, market, mode):
+        """
+        Newest unexpired entry of a market in either tier, whatever its
+        watermark (the disk tier keeps only the newest one per market).
+        Returns: pnl_by_date, or None
+        """
+        keys = sorted((key for key in self._pnl_cache if key[:2] == (market, mode)),
+                      key=lambda key: self._pnl_cache[key][0], reverse=True)
+        if self.cache_dir:
+            prefix = f"pnl-{market}-{mode}-"
+            for path in glob.glob(os.path.join(self.cache_dir, f"{prefix}*.pkl")):
+                keys.append((market, mode, os.path.basename(path)[len(prefix):-len(".pkl")]))
+
+        for key in keys:
+            pnl_dict = self._cache_get(key)
+            if pnl_dict is not None:
+                return pnl_dict
+        return None
+
+    def get_market_pnl(self, market, exact=False):
+        """
+        Realized PnL of one market, recomputed only when its orders changed.
+        A cache hit costs one REST page instead of the full history.
+        A result is cached only if every page was fetched successfully.
+        If the history cannot be fetched, the newest unexpired cached
+        result is served instead; with none, RuntimeError is raised rather
+        than reporting a missing or partial history as the market's PnL.
+        Returns: dict { 'YYYY-MM-DD': pnl_value } (Decimal values when exact)
+        """
+        mode = "exact" if exact else "float"
+        first_page = self.get_order_list(market, 1)
+        key = None if first_page is None else (market, mode, self._order_watermark(first_page))
+
+        pnl_dict = self._cache_get(key) if key else None
+        if pnl_dict is None and key:
+            columns, complete = self.collect_order_columns(market, first_page=first_page, exact=exact)
+            if complete:
+                pnl_dict = dict(self.calculate_columns_pnl(columns, exact=exact))
+                self._cache_put(key, pnl_dict)
+
+        if pnl_dict is None:
+            pnl_dict = self._cache_latest(market, mode)
+            if pnl_dict is None:
+                raise RuntimeError(f"{market}: order history unavailable and no cached PnL")
+            print(f"⚠️ {market}: order history unavailable, serving cached PnL")
+        return pnl_dict
+
+    # ----------------------------------------------------------
+    # Parquet Export (partitioned by market / year)
+    # ----------------------------------------------------------
+    ORDER_EXPORT_FIELDS = ["uuid", "side", "ord_type", "state", "created_at", "price",
+                           "avg_price", "volume", "executed_volume", "paid_fee", "trades_count"]
+    ORDER_NUMERIC_FIELDS = ["price", "avg_price", "volume", "executed_volume", "paid_fee"]
+
+    def _stage_partition(self, path, df, keys=None):
+        """
+        Write the new content of one partition file next to it, under a
+        hidden temp name; export_snapshot renames it into place.
+        With keys, rows already on disk are kept and new rows appended
+        (de-duplicated on keys); otherwise the partition is replaced.
+        Returns: (temp path, path), or None if the partition is unchanged
+        """
+        existing = pd.read_parquet(path) if os.path.exists(path) else None
+        if keys:
+            df = pd.concat([existing, df]).drop_duplicates(keys, keep="last")
+        df = df.sort_values(df.columns[0], kind="stable").reset_index(drop=True)
+
+        if existing is not None and df.equals(existing):
+            return None
+
+        # Hidden name: dataset readers skip dot-files, so a half-written or
+        # orphaned temp file is never read as part of the partition
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{os.path.basename(path)}.tmp")
+        df.to_parquet(tmp_path, index=False)
+        return tmp_path, path
+
+    def _stage_table(self, root, table, df, keys=None):
+        """
+        Stage df under root/table/market=.../year=.../part-0.parquet.
+        The partition columns live in the directory names, not in the files.
+        Returns: list of (temp path, path) for the partitions that changed
+        """
+        staged = []
+        for (market, year), part in df.groupby(["market", "year"]):
+            path = os.path.join(root, table, f"market={market}", f"year={year}", "part-0.parquet")
+            part = part.drop(columns=["market", "year"])
+            staged.append(self._stage_partition(path, part, keys))
+        return [pair for pair in staged if pair]
+
+    def export_snapshot(self, markets, root="snapshot", exact=False):
+        """
+        Exports orders, matched lots and PnL-by-day as Parquet datasets
+        partitioned by market and year (hive layout), for BI readers to
+        scan only the partitions they need, e.g.
+            pd.read_parquet("snapshot/pnl_by_day", filters=[("year", "=", 2025)])
+
+        Every run pages each market's full order history and recomputes all
+        of its lots; only the writing is incremental. Orders are appended
+        (de-duplicated on uuid), lots and PnL replaced, and a partition is
+        rewritten only if it changed. A market whose history could not be
+        fetched completely is skipped and keeps its previous partitions.
+
+        All changed partitions are written to temp files first and then
+        renamed into place, so a failure while writing leaves the previous
+        snapshot as it was. The renames are one file at a time: a crash
+        between them can leave tables from two runs side by side until
+        the next export.
+
+        exact=True matches in each market's own units (no rounding residue
+        lots); the values are still written as float64 columns.
+        Returns: dict { table: number of partitions written }
+        """
+        orders_frames, lots_frames, pnl_frames = [], [], []
+
+        for market in markets:
+            orders, complete = self.collect_all_orders(market)
+            if not complete:
+                print(f"⚠️ {market}: order history incomplete, export skipped")
+                continue
+            orders = sorted(orders, key=lambda x: x["created_at"])
+            units = None
+            if exact:
+                units = market_units(*([o[name] for o in orders] for name in OrderColumns.NUMERIC_FIELDS))
+            matcher = FifoMatcher(units, record_lots=True)
+            for order in orders:
+                matcher.add_order(order)
+
+            orders_df = pd.DataFrame(orders, columns=self.ORDER_EXPORT_FIELDS)
+            orders_df[self.ORDER_NUMERIC_FIELDS] = orders_df[self.ORDER_NUMERIC_FIELDS].astype(float)
+            orders_df["market"] = market
+            orders_df["year"] = orders_df["created_at"].str[:4].astype(int)
+            orders_frames.append(orders_df)
+
+            # Exact lots are in integer units; true division rounds once to float
+            price_scale, volume_scale = (10 ** units[0], 10 ** units[1]) if exact else (1, 1)
+            lots_df = pd.DataFrame(
+                [(buy_date, sell_date, buy_price / price_scale, sell_price / price_scale,
+                  volume / volume_scale, (sell_price - buy_price) * volume / (price_scale * volume_scale))
+                 for buy_date, sell_date, buy_price, sell_price, volume in matcher.lots],
+                columns=["buy_date", "sell_date", "buy_price", "sell_price", "volume", "pnl"]
+            )
+            lots_df["market"] = market
+            lots_df["year"] = lots_df["sell_date"].str[:4].astype(int)
+            lots_frames.append(lots_df)
+
+            pnl_df = pd.DataFrame(
+                [(date, float(pnl)) for date, pnl in matcher.pnl_amounts().items()], columns=["Date", "P/N"]
+            )
+            pnl_df["market"] = market
+            pnl_df["year"] = pnl_df["Date"].str[:4].astype(int)
+            pnl_frames.append(pnl_df)
+
+        if not orders_frames:
+            return {"orders": 0, "lots": 0, "pnl_by_day": 0}
+
+        staged = {
+            "orders": self._stage_table(root, "orders", pd.concat(orders_frames), keys=["uuid"]),
+            "lots": self._stage_table(root, "lots", pd.concat(lots_frames)),
+            "pnl_by_day": self._stage_table(root, "pnl_by_day", pd.concat(pnl_frames)),
+        }
+        for pairs in staged.values():
+            for tmp_path, path in pairs:
+                os.replace(tmp_path, path)
+        return {table: len(pairs) for table, pairs in staged.items()}
+
+    # ----------------------------------------------------------
+    # Candles & Backtest
+    # ----------------------------------------------------------
+    def get_candles(self, market, unit="days", count=200):
+        """
+        Fetches the latest `count` candles (newest first), 200 per request.
+        unit: 'days', 'weeks', 'minutes/60', ...
+        """
+        url = f"{self.BASE_URL}/v1/candles/{unit}"
+        candles = []
+        to = None
+        while len(candles) < count:
+            params = {"market": market, "count": min(200, count - len(candles))}
+            if to:
+                params["to"] = to
+            r = requests.get(url, headers={"Accept": "application/json"}, params=params)
+            if r.status_code != 200:
+                print("❌ API Error:", r.json())
+                break
+
+            page = _json_loads(r.content)
+            if not page:
+                break
+            candles.extend(page)
+            to = page[-1]["candle_date_time_utc"]
+            time.sleep(0.1)
+        return candles
+
+    def load_candles(self, market, unit="days", count=200, cache_dir="candles",
+                     max_age=3600, refresh=False):
+        """
+        Candles oldest → newest as a DataFrame, cached as CSV under cache_dir
+        so repeated backtests do not hit the API. The cache is refetched when
+        it is older than max_age seconds, too short, or refresh=True.
+        """
+        path = os.path.join(cache_dir, f"{market}-{unit.replace('/', '')}.csv")
+        if not refresh and os.path.exists(path) and time.time() - os.path.getmtime(path) <= max_age:
+            df = pd.read_csv(path)
+            if len(df) >= count:
+                return df.tail(count).reset_index(drop=True)
+
+        candles = self.get_candles(market, unit, count)
+        df = pd.DataFrame(candles, columns=["candle_date_time_kst", "trade_price"])
+        df = df.drop_duplicates("candle_date_time_kst").sort_values("candle_date_time_kst")
+        df = df.reset_index(drop=True)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_csv(path, index=False)
+        return df
+
+    def backtest(self, markets, short_windows, long_windows, unit="days", count=1000,
+                 notional=1_000_000, fee_rate=FEE_RATE, workers=None, chunk_size=64,
+                 refresh=False):
+        """
+        Moving-average crossover backtest over every (short, long) pair.
+        Buys `notional` KRW when the short MA crosses above the long MA and
+        sells the whole lot when it crosses back, as /v1/orders-shaped records
+        run through the same FIFO matcher as calculate_real_pnl.
+        Work is split into (market, chunk of pairs) tasks over a process pool.
+        refresh=True refetches candles instead of using the cache.
+        Returns: DataFrame [Crypto, Short, Long, Trades, P/N], best first.
+        """
+        params = [(s, l) for s in short_windows for l in long_windows if s < l]
+
+        tasks = []
+        for market in markets:
+            candles = self.load_candles(market, unit, count, refresh=refresh)
+            created_at = (candles["candle_date_time_kst"] + "+09:00").tolist()
+            close = candles["trade_price"].to_numpy(dtype=np.float64)
+            for i in range(0, len(params), chunk_size):
+                tasks.append((market, created_at, close, params[i:i + chunk_size],
+                              notional, fee_rate))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = [row for chunk in pool.map(_backtest_worker, tasks) for row in chunk]
+
+        df = pd.DataFrame(rows, columns=["Crypto", "Short", "Long", "Trades", "P/N"])
+        df.sort_values(by="P/N", ascending=False, inplace=True)
+        return df.reset_index(drop=True)
 
     # ----------------------------------------------------------
     # NEW: Full PNL DataFrame Builder
     # ----------------------------------------------------------
-    def compute_pnl_dataframe(self, markets):
+    def compute_pnl_dataframe(self, markets, exact=False):
         """
         Fetches order history for all markets,
         computes realized PNL per-day per-crypto,
         and returns a tidy DataFrame.
+        Markets whose orders have not changed are served from cache.
+        A market whose PnL is unavailable raises (see get_market_pnl)
+        instead of silently dropping out of the report.
+        With exact=True, P/N holds exact Decimal values.
         """
-        total_pnl = defaultdict(float)
+        total_pnl = defaultdict(Decimal if exact else float)
 
         for market in markets:
-            orders = self.collect_all_orders(market)
-            pnl_dict = self.calculate_real_pnl(orders)
+            pnl_dict = self.get_market_pnl(market, exact=exact)
 
             for date, pnl_value in pnl_dict.items():
                 total_pnl[(date, market)] += pnl_value
@@ -159,8 +1007,29 @@ class UpbitAPI:
 if __name__ == "__main__":
     upbit = UpbitAPI()
     markets = ["KRW-BTC", "KRW-ETH", "KRW-SOL", "KRW-XRP"]
+    exact = "--exact" in sys.argv
+
+    if "--stream" in sys.argv:
+        def print_update(market, order, date_str, pnl, pnl_by_date):
+            print(f"{date_str} {market} {order['side']}: ₩{pnl:,.0f} "
+                  f"(일 손익 ₩{pnl_by_date[date_str]:,.0f})")
+
+        upbit.stream_pnl(markets, on_update=print_update, exact=exact)
+        sys.exit(0)
+
+    if "--backtest" in sys.argv:
+        results = upbit.backtest(markets, range(2, 30), range(5, 120))
+        pd.set_option('display.float_format', '{:,.0f}'.format)
+        print(results.groupby("Crypto").head(5))
+        sys.exit(0)
+
+    if "--export" in sys.argv:
+        written = upbit.export_snapshot(markets, exact=exact)
+        for table, count in written.items():
+            print(f"{table}: {count}개 파티션 저장")
+        sys.exit(0)
 
-    df = upbit.compute_pnl_dataframe(markets)
+    df = upbit.compute_pnl_dataframe(markets, exact=exact)
 
     pd.set_option('display.float_format', '{:,.0f}'.format)
     print(df)